@@ -71,3 +71,27 @@ ENSEMBLE_MISSING_COV = {
     "CONFIG_NAME": "simplenet_no_cov",
     "DEVICE": "CPU",
 }
+
+SMALL_SIMPLENET = {
+    "ARCHITECTURE": "VocalocatorSimpleNetwork",
+    "MODEL_PARAMS": {
+        "OUTPUT_TYPE": "GAUSSIAN_FULL_COV",
+        "CONV_NUM_CHANNELS": [8, 8, 16, 16],
+        "CONV_FILTER_SIZES": [9, 9, 9, 9],
+        "SHOULD_DOWNSAMPLE": [False, True, True, True],
+        "CONV_DILATIONS": [1, 1, 1, 1],
+    },
+    "GENERAL": {"DEVICE": "CPU"},
+    "DATA": {
+        "NUM_MICROPHONES": 4,
+        "ARENA_DIMS": [600, 400],
+        "ARENA_DIMS_UNITS": "MM",
+        "SAMPLE_RATE": 125000,
+        "CROP_LENGTH": 1024,
+        "BATCH_SIZE": 8,
+    },
+}
+
+SMALL_CORRNET = copy.deepcopy(SMALL_SIMPLENET)
+SMALL_CORRNET["ARCHITECTURE"] = "CorrSimpleNetwork"
+SMALL_CORRNET["MODEL_PARAMS"].update({"CPS_HIDDEN_SIZE": 32, "XCORR_LENGTH": 64})
@@ -0,0 +1,43 @@
+"""
+Test the helpers used to write assessment results.
+"""
+
+import tempfile
+import unittest
+from pathlib import Path
+
+import h5py
+import numpy as np
+from vocalocator.assess import BufferedDatasetWriter
+
+
+class TestBufferedDatasetWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.f = h5py.File(Path(self.tmpdir.name) / "out.h5", "w")
+
+    def tearDown(self):
+        self.f.close()
+        self.tmpdir.cleanup()
+
+    def test_empty_dataset(self):
+        writer = BufferedDatasetWriter(self.f, "empty", shape=(0, 2))
+        writer.write(np.empty((0, 2), dtype=np.float32))
+        writer.flush()
+        self.assertEqual(self.f["empty"].shape, (0, 2))
+
+    def test_fewer_rows_than_buffer(self):
+        rows = np.arange(10, dtype=np.float32).reshape(5, 2)
+        writer = BufferedDatasetWriter(self.f, "small", shape=(5, 2), buffer_rows=64)
+        writer.write(rows[:3])
+        writer.write(rows[3:])
+        writer.flush()
+        np.testing.assert_array_equal(self.f["small"][:], rows)
+
+    def test_writes_spanning_flushes(self):
+        rows = np.arange(22, dtype=np.float32).reshape(11, 2)
+        writer = BufferedDatasetWriter(self.f, "large", shape=(11, 2), buffer_rows=4)
+        for start in range(0, 11, 3):
+            writer.write(rows[start : start + 3])
+        writer.flush()
+        np.testing.assert_array_equal(self.f["large"][:], rows)
@@ -0,0 +1,111 @@
+"""
+Test that the weight-level rewrites of the simple networks (loading legacy
+checkpoints, batch norm folding) leave their outputs unchanged.
+"""
+
+import copy
+import unittest
+
+import torch
+from constants import SMALL_CORRNET, SMALL_SIMPLENET
+from torch import nn
+from vocalocator.architectures.simplenet import VocalocatorSimpleLayer
+from vocalocator.training.models import build_model, fold_batch_norm
+
+
+def randomize_batch_norms(model: nn.Module):
+    """Give every batch norm non-trivial statistics and affine parameters."""
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, nn.modules.batchnorm._BatchNorm):
+                module.running_mean.uniform_(-0.2, 0.2)
+                module.running_var.uniform_(0.5, 1.5)
+                module.weight.uniform_(0.5, 1.5)
+                module.bias.uniform_(-0.2, 0.2)
+
+
+class LegacySimpleLayer(nn.Module):
+    """VocalocatorSimpleLayer as it was before the filter and gate convolutions were fused."""
+
+    def __init__(self, channels_in, channels_out, filter_size, *, downsample):
+        super().__init__()
+        stride = 2 if downsample else 1
+        self.fc = nn.Conv1d(channels_in, channels_out, filter_size, stride=stride)
+        self.gc = nn.Conv1d(channels_in, channels_out, filter_size, stride=stride)
+        self.batch_norm = nn.BatchNorm1d(channels_out)
+
+    def forward(self, x):
+        fcx = self.fc(x)
+        fcx_activated = torch.tanh(fcx) * 0.95 + fcx * 0.05
+        gcx_activated = torch.sigmoid(self.gc(x))
+        return self.batch_norm(fcx_activated * gcx_activated)
+
+
+class TestLegacyCheckpoints(unittest.TestCase):
+    def test_load_unfused_layer(self):
+        torch.manual_seed(0)
+        legacy = LegacySimpleLayer(4, 8, 9, downsample=True)
+        randomize_batch_norms(legacy)
+        legacy.eval()
+        x = torch.randn(3, 4, 256)
+
+        for channels_last in (False, True):
+            layer = VocalocatorSimpleLayer(
+                4, 8, 9, downsample=True, dilation=1, channels_last=channels_last
+            )
+            layer.load_state_dict(legacy.state_dict())
+            layer.eval()
+            layer_input = x.unsqueeze(2) if channels_last else x
+            output = layer(layer_input)
+            if channels_last:
+                output = output.squeeze(2)
+            torch.testing.assert_close(output, legacy(x))
+
+    def test_mismatched_checkpoint_raises(self):
+        # same number of elements in the conv weight, but a different shape
+        layer = VocalocatorSimpleLayer(4, 8, 9, downsample=False, dilation=1)
+        other = VocalocatorSimpleLayer(8, 4, 9, downsample=False, dilation=1)
+        with self.assertRaises(RuntimeError):
+            other.load_state_dict(layer.state_dict())
+
+
+class TestBatchNormFolding(unittest.TestCase):
+    VARIANTS = {
+        "plain": {},
+        "channels_last": {"CHANNELS_LAST": True},
+        "depthwise_separable": {"USE_DEPTHWISE_SEPARABLE": True},
+    }
+
+    def check_folding(self, base_config: dict):
+        x = torch.randn(3, base_config["DATA"]["CROP_LENGTH"], 4)
+        for name, params in self.VARIANTS.items():
+            with self.subTest(arch=base_config["ARCHITECTURE"], variant=name):
+                config = copy.deepcopy(base_config)
+                config["MODEL_PARAMS"].update(params)
+                torch.manual_seed(0)
+                model, _ = build_model(config)
+                randomize_batch_norms(model)
+                model.eval()
+                with torch.no_grad():
+                    expected = model._forward(x)
+                    fold_batch_norm(model)
+                    self.assertFalse(
+                        any(
+                            isinstance(m, nn.modules.batchnorm._BatchNorm)
+                            for m in model.modules()
+                        )
+                    )
+                    torch.testing.assert_close(
+                        model._forward(x), expected, atol=1e-5, rtol=1e-4
+                    )
+                    # folding again is a no-op
+                    fold_batch_norm(model)
+                    torch.testing.assert_close(
+                        model._forward(x), expected, atol=1e-5, rtol=1e-4
+                    )
+
+    def test_simplenet(self):
+        self.check_folding(SMALL_SIMPLENET)
+
+    def test_corrnet(self):
+        self.check_folding(SMALL_CORRNET)
@@ -67,7 +67,9 @@ class VocalocatorArchitecture(torch.nn.Module):
         Run the model on input `x` and return an appropriate
         ModelOutput object, determined based on `self.output_factory`.
         """
-        raw_outputs = self._forward(x)
+        # under autocast the raw outputs may be reduced precision, but the
+        # output distributions are always parameterized in float32
+        raw_outputs = self._forward(x).float()
         if unbatched:
             outputs = []
             for o in raw_outputs:
@@ -75,4 +77,4 @@ class VocalocatorArchitecture(torch.nn.Module):
                 outputs.append(self.output_factory.create_output(o[None]))
             return outputs
         else:
-            return self.output_factory.create_output(self._forward(x))
+            return self.output_factory.create_output(raw_outputs)
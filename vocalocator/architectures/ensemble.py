@@ -1,3 +1,5 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal, overload
 
 import torch
@@ -50,8 +52,16 @@ class VocalocatorEnsemble(VocalocatorArchitecture):
         """
         # best_weights_path included for consistency of signature
         # with `VocalocatorArchitecture.load_weights`
-        for model in self.models:
-            model.load_weights(use_final_weights=use_final_weights)
+
+        # reading each checkpoint is mostly file io, so load them concurrently
+        n_workers = min(len(self.models), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+            futures = [
+                executor.submit(model.load_weights, use_final_weights=use_final_weights)
+                for model in self.models
+            ]
+            for future in futures:
+                future.result()
 
     # add overload for nice unbatched functionality
     @overload
@@ -2,9 +2,17 @@ import torch
 from torch import nn
 
 from vocalocator.architectures.base import VocalocatorArchitecture
+from vocalocator.architectures.util import fold_batch_norm, gated_activation
 from vocalocator.outputs import ModelOutputFactory
 
 
+def _squeeze_height(shape: torch.Size) -> tuple:
+    """Drop the height 1 axis of a Conv2d kernel shape to compare it to a Conv1d one."""
+    if len(shape) == 4 and shape[2] == 1:
+        return (*shape[:2], shape[3])
+    return tuple(shape)
+
+
 class VocalocatorSimpleLayer(torch.nn.Module):
     def __init__(
         self,
@@ -14,35 +22,82 @@ class VocalocatorSimpleLayer(torch.nn.Module):
         *,
         downsample: bool,
         dilation: int,
-        use_bn: bool = True
+        use_bn: bool = True,
+        channels_last: bool = False,
+        depthwise_separable: bool = False,
     ):
         super(VocalocatorSimpleLayer, self).__init__()
-        self.fc = torch.nn.Conv1d(
-            channels_in,
-            channels_out,
-            filter_size,
-            stride=(2 if downsample else 1),
-            dilation=dilation,
-        )
-        self.gc = torch.nn.Conv1d(
-            channels_in,
-            channels_out,
-            filter_size,
-            stride=(2 if downsample else 1),
-            dilation=dilation,
-        )
-        self.batch_norm = (
-            torch.nn.BatchNorm1d(channels_out) if use_bn else nn.Identity()
-        )
+        self.depthwise_separable = depthwise_separable
+        # the filter and gate convolutions share their input and shape, so
+        # they are computed together as one convolution with twice the
+        # output channels: [filter channels, gate channels]
+        if channels_last:
+            # treat the signal as an image of height 1 so cudnn can use its
+            # NHWC kernels, expects input of shape (batch, channels, 1, seq_len)
+            conv = torch.nn.Conv2d
+            filter_size = (1, filter_size)
+            stride = (1, 2 if downsample else 1)
+            dilation = (1, dilation)
+            batch_norm = torch.nn.BatchNorm2d
+        else:
+            conv = torch.nn.Conv1d
+            stride = 2 if downsample else 1
+            batch_norm = torch.nn.BatchNorm1d
+
+        if depthwise_separable:
+            # filter each input channel separately, then mix the channels
+            # with a pointwise convolution
+            self.conv = nn.Sequential(
+                conv(
+                    channels_in,
+                    channels_in,
+                    filter_size,
+                    stride=stride,
+                    dilation=dilation,
+                    groups=channels_in,
+                ),
+                conv(channels_in, channels_out * 2, 1),
+            )
+        else:
+            self.conv = conv(
+                channels_in,
+                channels_out * 2,
+                filter_size,
+                stride=stride,
+                dilation=dilation,
+            )
+        self.batch_norm = batch_norm(channels_out) if use_bn else nn.Identity()
+
+    @property
+    def input_conv(self) -> nn.Module:
+        """The convolution which reads the input of this layer."""
+        return self.conv[0] if self.depthwise_separable else self.conv
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints saved before the filter and gate convolutions were fused
+        # store them as separate `fc` and `gc` modules
+        for param in ("weight", "bias"):
+            fc_key, gc_key = f"{prefix}fc.{param}", f"{prefix}gc.{param}"
+            if fc_key in state_dict and gc_key in state_dict:
+                state_dict[f"{prefix}conv.{param}"] = torch.cat(
+                    (state_dict.pop(fc_key), state_dict.pop(gc_key))
+                )
+        # allow weights to move between the Conv1d and channels last Conv2d
+        # layouts, which differ only by the height 1 axis of the kernel
+        for name, conv in self.named_modules():
+            if not isinstance(conv, (nn.Conv1d, nn.Conv2d)):
+                continue
+            weight_key = f"{prefix}{name}.weight"
+            weight = state_dict.get(weight_key)
+            if weight is not None and _squeeze_height(weight.shape) == _squeeze_height(
+                conv.weight.shape
+            ):
+                state_dict[weight_key] = weight.reshape(conv.weight.shape)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def forward(self, x):
-        fcx = self.fc(x)
-        fcx_activated = torch.tanh(fcx) * 0.95 + fcx * 0.05
-
-        gcx = self.gc(x)
-        gcx_activated = torch.sigmoid(gcx)
-
-        prod = fcx_activated * gcx_activated
+        fcx, gcx = self.conv(x).chunk(2, dim=1)
+        prod = gated_activation(fcx, gcx)
         return self.batch_norm(prod)
 
 
@@ -55,6 +110,8 @@ class VocalocatorSimpleNetwork(VocalocatorArchitecture):
         "CONV_DILATIONS": [1] * 10,
         "OUTPUT_COV": True,
         "REGULARIZE_COV": False,
+        "CHANNELS_LAST": False,
+        "USE_DEPTHWISE_SEPARABLE": False,
     }
 
     def __init__(self, CONFIG, output_factory: ModelOutputFactory):
@@ -85,6 +142,8 @@ class VocalocatorSimpleNetwork(VocalocatorArchitecture):
         dilations = dilations[:min_len]
 
         use_batch_norm = model_config["USE_BATCH_NORM"]
+        self.channels_last = model_config["CHANNELS_LAST"]
+        depthwise_separable = model_config["USE_DEPTHWISE_SEPARABLE"]
 
         self.n_channels.insert(0, N)
 
@@ -96,6 +155,8 @@ class VocalocatorSimpleNetwork(VocalocatorArchitecture):
                 downsample=downsample,
                 dilation=dilation,
                 use_bn=use_batch_norm,
+                channels_last=self.channels_last,
+                depthwise_separable=depthwise_separable,
             )
             for in_channels, out_channels, filter_size, downsample, dilation in zip(
                 self.n_channels[:-1],
@@ -106,8 +167,8 @@ class VocalocatorSimpleNetwork(VocalocatorArchitecture):
             )
         ]
         self.conv_layers = torch.nn.Sequential(*convolutions)
-
-        self.final_pooling = nn.AdaptiveAvgPool1d(1)
+        if self.channels_last:
+            self.conv_layers.to(memory_format=torch.channels_last)
 
         if not isinstance(self.n_outputs, int):
             raise ValueError(
@@ -119,10 +180,33 @@ class VocalocatorSimpleNetwork(VocalocatorArchitecture):
         x = x.transpose(
             -1, -2
         )  # (batch, seq_len, channels) -> (batch, channels, seq_len) needed by conv1d
-        h1 = self.conv_layers(x)
-        h2 = torch.squeeze(self.final_pooling(h1), dim=-1)
+        if self.channels_last:
+            x = x.unsqueeze(-2).contiguous(memory_format=torch.channels_last)
+            h1 = self.conv_layers(x).squeeze(-2)
+        else:
+            h1 = self.conv_layers(x)
+        # global average pool over time
+        h2 = h1.mean(dim=-1)
         coords = self.coord_readout(h2)
         return coords
 
+    def fold_batch_norm(self):
+        """
+        Fold the running statistics of each convolutional layer's batch norm
+        into the layer reading its output (the next convolution, or the
+        coordinate readout after global pooling) and remove the batch norm.
+
+        The folded network is equivalent to the original in eval mode only,
+        so this should be called after loading weights and never before
+        training or saving a checkpoint.
+        """
+        consumers = [layer.input_conv for layer in self.conv_layers[1:]]
+        consumers.append(self.coord_readout)
+        for layer, consumer in zip(self.conv_layers, consumers):
+            if isinstance(layer.batch_norm, nn.Identity):
+                continue
+            fold_batch_norm(layer.batch_norm, consumer)
+            layer.batch_norm = nn.Identity()
+
     def clip_grads(self):
         nn.utils.clip_grad_norm_(self.parameters(), 1.0, error_if_nonfinite=True)
@@ -5,6 +5,7 @@ import torch
 from torch import nn
 
 from vocalocator.architectures.base import VocalocatorArchitecture
+from vocalocator.architectures.util import fold_batch_norm
 from vocalocator.outputs import ModelOutputFactory
 
 from .simplenet import VocalocatorSimpleLayer
@@ -31,6 +32,8 @@ class CorrSimpleNetwork(VocalocatorArchitecture):
         "CPS_NUM_LAYERS": 3,
         "CPS_HIDDEN_SIZE": 1024,
         "XCORR_LENGTH": 256,
+        "CHANNELS_LAST": False,
+        "USE_DEPTHWISE_SEPARABLE": False,
     }
 
     def __init__(self, CONFIG, output_factory: ModelOutputFactory):
@@ -63,6 +66,8 @@ class CorrSimpleNetwork(VocalocatorArchitecture):
         dilations = dilations[:min_len]
 
         use_batch_norm = model_config["USE_BATCH_NORM"]
+        self.channels_last = model_config["CHANNELS_LAST"]
+        depthwise_separable = model_config["USE_DEPTHWISE_SEPARABLE"]
         self.n_channels.insert(0, N)
 
         convolutions = [
@@ -73,6 +78,8 @@ class CorrSimpleNetwork(VocalocatorArchitecture):
                 downsample=downsample,
                 dilation=dilation,
                 use_bn=use_batch_norm,
+                channels_last=self.channels_last,
+                depthwise_separable=depthwise_separable,
             )
             for in_channels, out_channels, filter_size, downsample, dilation in zip(
                 self.n_channels[:-1],
@@ -83,8 +90,16 @@ class CorrSimpleNetwork(VocalocatorArchitecture):
             )
         ]
         self.conv_layers = torch.nn.Sequential(*convolutions)
-
-        self.final_pooling = nn.AdaptiveAvgPool1d(1)
+        if self.channels_last:
+            self.conv_layers.to(memory_format=torch.channels_last)
+
+        # all pairwise combinations of channels, kept as a buffer so that it
+        # lives on the same device as the model. for 4 mics, shape is (6, 2)
+        self.register_buffer(
+            "channel_pairs",
+            torch.tensor(list(combinations(range(N), 2))),
+            persistent=False,
+        )
 
         # layers for the cps branch of the network:
         cps_initial_channels = (
@@ -129,16 +144,10 @@ class CorrSimpleNetwork(VocalocatorArchitecture):
 
         output_length = self.xcorr_length
 
-        seq_len, n_channels = audio.shape[-2:]
-
-        # Get all pairwise combinations of channels
-        channel_pairs = list(combinations(range(n_channels), 2))
-        channel_pairs = torch.tensor(channel_pairs)  # for 4 mics, shape is (6, 2)
-
         rfft_audio = torch.fft.rfft(audio, dim=-2)  # (batch, n_rfreq, n_channels)
 
-        lhs = rfft_audio[:, :, channel_pairs[:, 0]]
-        rhs = rfft_audio[:, :, channel_pairs[:, 1]]
+        lhs = rfft_audio[:, :, self.channel_pairs[:, 0]]
+        rhs = rfft_audio[:, :, self.channel_pairs[:, 1]]
         f_xcorr = lhs * rhs.conj()  # both complex, shape is (batch, n_rfreq, n_pairs)
         cps = torch.fft.irfft(f_xcorr, dim=-2)
         # shape is (batch, n_samples, n_pairs)
@@ -160,8 +169,13 @@ class CorrSimpleNetwork(VocalocatorArchitecture):
         audio = audio.transpose(
             -1, -2
         )  # (batch, seq_len, channels) -> (batch, channels, seq_len) needed by conv1d
-        h1 = self.conv_layers(audio)
-        h2 = torch.squeeze(self.final_pooling(h1), dim=-1)
+        if self.channels_last:
+            audio = audio.unsqueeze(-2).contiguous(memory_format=torch.channels_last)
+            h1 = self.conv_layers(audio).squeeze(-2)
+        else:
+            h1 = self.conv_layers(audio)
+        # global average pool over time
+        h2 = h1.mean(dim=-1)
 
         cps_branch = self.cps_network(cps)
         h2 = torch.cat((h2, cps_branch), dim=-1)
@@ -169,5 +183,30 @@ class CorrSimpleNetwork(VocalocatorArchitecture):
         coords = self.coord_readout(h2)
         return coords
 
+    def fold_batch_norm(self):
+        """
+        Fold the running statistics of the batch norms into the layers reading
+        their output and remove them. This covers each convolutional layer
+        (folded into the next convolution, or into the conv features of the
+        coordinate readout after global pooling) and the input batch norm of
+        the cps branch.
+
+        The folded network is equivalent to the original in eval mode only,
+        so this should be called after loading weights and never before
+        training or saving a checkpoint.
+        """
+        conv_features = slice(0, self.n_channels[-1])
+        consumers = [(layer.input_conv, slice(None)) for layer in self.conv_layers[1:]]
+        consumers.append((self.coord_readout[0], conv_features))
+        for layer, (consumer, in_channels) in zip(self.conv_layers, consumers):
+            if isinstance(layer.batch_norm, nn.Identity):
+                continue
+            fold_batch_norm(layer.batch_norm, consumer, in_channels)
+            layer.batch_norm = nn.Identity()
+
+        if not isinstance(self.cps_network[0], nn.Identity):
+            fold_batch_norm(self.cps_network[0], self.cps_network[1])
+            self.cps_network[0] = nn.Identity()
+
     def clip_grads(self):
         nn.utils.clip_grad_norm_(self.parameters(), 1.0, error_if_nonfinite=True)
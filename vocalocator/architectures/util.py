@@ -32,3 +32,57 @@ def build_cov_output(raw_output, device):
     # concat the two to make a (batch, 3, 2) tensor
     concatenated = torch.cat((y_hat, L), dim=-2)
     return concatenated
+
+
+def gated_activation(fcx: torch.Tensor, gcx: torch.Tensor) -> torch.Tensor:
+    """
+    Gated activation shared by the convolutional blocks, equal to
+
+        (0.95 * tanh(fcx) + 0.05 * fcx) * sigmoid(gcx).
+
+    The leaky tanh is computed with a single `torch.lerp` rather than a chain
+    of scalar multiplies and an add, so the expression launches four pointwise
+    kernels instead of six.
+    """
+    return torch.lerp(fcx, torch.tanh(fcx), 0.95) * torch.sigmoid(gcx)
+
+
+@torch.no_grad()
+def fold_batch_norm(
+    batch_norm: torch.nn.modules.batchnorm._BatchNorm,
+    layer: torch.nn.Module,
+    in_channels: slice = slice(None),
+):
+    """
+    Fold the inference-time affine transform of `batch_norm` into the weights
+    of `layer`, a convolution or linear layer whose input channels
+    `in_channels` are the (possibly time-averaged) output of the batch norm.
+    Modifies `layer` in place, after which the batch norm may be dropped.
+
+    Only valid when `layer` does not zero pad its input, since the padding
+    would otherwise be shifted along with the signal.
+    """
+    scale = batch_norm.weight * torch.rsqrt(batch_norm.running_var + batch_norm.eps)
+    shift = batch_norm.bias - batch_norm.running_mean * scale
+
+    # weight has shape (out_channels, in_channels // groups, *kernel_size)
+    weight = layer.weight[:, in_channels]
+    groups = getattr(layer, "groups", 1)
+    if groups > 1:
+        # each output channel of a grouped convolution only reads the input
+        # channels of its own group
+        out_channels, group_size = weight.shape[:2]
+        group = torch.arange(out_channels, device=weight.device) // (
+            out_channels // groups
+        )
+        channel_idx = group[:, None] * group_size + torch.arange(
+            group_size, device=weight.device
+        )
+        scale, shift = scale[channel_idx], shift[channel_idx]
+    else:
+        scale, shift = scale[None], shift[None]
+
+    broadcast_shape = scale.shape + (1,) * (weight.ndim - 2)
+    scale, shift = scale.view(broadcast_shape), shift.view(broadcast_shape)
+    layer.bias += (weight * shift).sum(dim=tuple(range(1, weight.ndim)))
+    weight *= scale
@@ -2,6 +2,7 @@ import torch
 from torch import nn
 
 from vocalocator.architectures.base import VocalocatorArchitecture
+from vocalocator.architectures.util import gated_activation
 from vocalocator.outputs import ModelOutputFactory
 
 
@@ -36,9 +37,7 @@ class WavenetBlock(nn.Module):
     def forward(self, x: torch.Tensor):
         conv_out = self.conv(x)
         tanh, sigmoid = conv_out.chunk(2, dim=-2)
-        tanh = torch.tanh(tanh) * 0.95 + 0.05 * tanh
-        sigmoid = torch.sigmoid(sigmoid)
-        activation = tanh * sigmoid
+        activation = gated_activation(tanh, sigmoid)
         one_by_one_output = self.one_by_one(activation)
         return one_by_one_output + x, one_by_one_output
 
@@ -22,45 +22,96 @@ from vocalocator.architectures.ensemble import VocalocatorEnsemble
 from vocalocator.calibration import CalibrationAccumulator
 from vocalocator.outputs.base import ModelOutput, ProbabilisticOutput, Unit
 from vocalocator.training.configs import build_config
-from vocalocator.training.dataloaders import VocalizationDataset
-from vocalocator.training.models import build_model
-from vocalocator.util import make_xy_grids, subplots
+from vocalocator.training.dataloaders import (
+    PreloadedBatches,
+    VocalizationDataset,
+    available_cpus,
+)
+from vocalocator.training.models import (
+    build_model,
+    compile_model,
+    export_model,
+    fold_batch_norm,
+)
+from vocalocator.util import subplots
 
 logging.getLogger("matplotlib").setLevel(logging.WARNING)
 
 FIRST_N_VOX_TO_PLOT = 16
+# number of rows accumulated in memory before each write to an output dataset
+WRITE_BUFFER_ROWS = 4096
 
 
-def plot_results(f: h5py.File):
+class BufferedDatasetWriter:
     """
-    Create and save plots of calibration curve, error distributions, etc.
+    Helper class which creates an h5 dataset and fills it sequentially,
+    accumulating rows in memory and writing them to disk in large contiguous
+    blocks rather than issuing one small write per batch.
     """
-    point_predictions = f["point_predictions"][:]
 
-    errs = np.linalg.norm(point_predictions - f["scaled_locations"][:], axis=-1)
-    if "calibration_curve" not in f.attrs:
-        fig, err_ax = plt.subplots(1, 1, sharex=False, sharey=False)
+    def __init__(
+        self,
+        f: h5py.File,
+        name: str,
+        shape: tuple[int, ...],
+        dtype: np.dtype = np.float32,
+        buffer_rows: int = WRITE_BUFFER_ROWS,
+    ):
+        buffer_rows = max(1, min(buffer_rows, shape[0]))
+        # match the chunk size to the buffer so each flush covers whole chunks.
+        # h5py can't chunk an empty dataset, so those are left contiguous
+        chunks = (buffer_rows, *shape[1:]) if shape[0] else None
+        self.dataset = f.create_dataset(name, shape=shape, dtype=dtype, chunks=chunks)
+        self.buffer = np.empty((buffer_rows, *shape[1:]), dtype=dtype)
+        # dataset row at which the contents of the buffer will be written
+        self.start = 0
+        self.n_buffered = 0
+
+    def write(self, rows: np.ndarray):
+        """
+        Append `rows` to the dataset, flushing to disk whenever the buffer fills.
+        """
+        while len(rows):
+            n = min(len(rows), len(self.buffer) - self.n_buffered)
+            self.buffer[self.n_buffered : self.n_buffered + n] = rows[:n]
+            self.n_buffered += n
+            rows = rows[n:]
+            if self.n_buffered == len(self.buffer):
+                self.flush()
+
+    def flush(self):
+        """
+        Write all buffered rows to the dataset.
+        """
+        if self.n_buffered:
+            end = self.start + self.n_buffered
+            self.dataset[self.start : end] = self.buffer[: self.n_buffered]
+            self.start = end
+            self.n_buffered = 0
 
-        # convert errs to cm for readability
-        errs_cm = errs / 10
 
-        err_ax.hist(errs_cm, color="tab:blue")
-        err_ax.set_xlabel("errors (cm)")
-        err_ax.set_ylabel("counts")
-        err_ax.set_title("error distribution")
-        return fig, err_ax
-    else:
-        fig, axs = plt.subplots(1, 5, sharex=False, sharey=False, figsize=(20, 4))
-        (err_ax, calib_ax, cset_area_ax, cset_radius_ax, dist_ax) = axs.flat
+def plot_results(f: h5py.File):
+    """
+    Create and save plots of calibration curve, error distributions, etc.
+    """
+    # convert errs to cm for readability
+    errs = np.linalg.norm(f["point_predictions"][:] - f["scaled_locations"][:], axis=-1)
+    errs_cm = errs / 10
 
-        # convert errs to cm for readability
-        errs_cm = errs / 10
+    has_calibration = "calibration_curve" in f.attrs
+    if has_calibration:
+        fig, axs = plt.subplots(1, 5, sharex=False, sharey=False, figsize=(20, 4))
+        err_ax, calib_ax, cset_area_ax, cset_radius_ax, dist_ax = axs.flat
+    else:
+        fig, axs = plt.subplots(1, 1, sharex=False, sharey=False)
+        err_ax = axs
 
-        err_ax.hist(errs_cm, color="tab:blue")
-        err_ax.set_xlabel("errors (cm)")
-        err_ax.set_ylabel("counts")
-        err_ax.set_title("error distribution")
+    err_ax.hist(errs_cm, color="tab:blue")
+    err_ax.set_xlabel("errors (cm)")
+    err_ax.set_ylabel("counts")
+    err_ax.set_title("error distribution")
 
+    if has_calibration:
         calib_ax.plot(np.linspace(0, 1, 11), f.attrs["calibration_curve"][:], "bo")
         calib_ax.set_xlabel("probability assigned to region")
         calib_ax.set_ylabel("proportion of locations in the region")
@@ -85,18 +136,55 @@ def plot_results(f: h5py.File):
         dist_ax.set_ylabel("error (cm)")
         dist_ax.set_title("distance to furthest point vs error")
 
-        return fig, axs
+    return fig, axs
+
+
+def visualize_predictions(
+    point_predictions: np.ndarray,
+    scaled_locations: np.ndarray,
+    confidence_sets: list[np.ndarray],
+    grids: tuple[np.ndarray, np.ndarray],
+    outfile: Path,
+) -> Path:
+    """
+    Plot the predicted and true locations of the first few vocalizations
+    along with their confidence sets, returning the path to the saved figure.
+    `grids` holds the x and y coordinates of the confidence set bin centers.
+    """
+    visualize_dir = outfile.parent / "pmfs_visualized"
+    visualize_dir.mkdir(exist_ok=True, parents=True)
+    visualize_outfile = visualize_dir / f"{outfile.stem}_visualized.png"
+
+    _, axs = subplots(len(point_predictions))
+
+    for i, ax in enumerate(axs):
+        ax.set_title(f"vocalization {i}")
+        ax.plot(*point_predictions[i], "ro", label="predicted")
+        # add a green dot indicating the true location
+        ax.plot(*scaled_locations[i], "go", label="true")
+        ax.set_aspect("equal", "box")
+
+        ax.contourf(
+            *grids,
+            confidence_sets[i],
+            label="95% confidence set",
+        )
+        ax.legend()
+
+    plt.savefig(visualize_outfile)
+    return visualize_outfile
 
 
 def assess_model(
     model: VocalocatorArchitecture,
-    dataloader: DataLoader,
+    dataloader: Union[DataLoader, PreloadedBatches],
     outfile: Union[Path, str],
     arena_dims: Union[np.ndarray, tuple[float, float]],
     device: Union[str, torch.device] = "cuda:0",
     visualize: bool = False,
     temperature: float = 1.0,
     inference: bool = False,
+    mixed_precision: bool = False,
 ):
     """
     Assess the provided model with uncertainty, storing model output as well as
@@ -107,11 +195,12 @@ def assess_model(
 
     Args:
         model: instantiated VocalocatorArchitecture object
-        dataloader: DataLoader object on which the model should be assessed
+        dataloader: DataLoader (or PreloadedBatches) object on which the model should be assessed
         outfile: path to an h5 file in which output should be saved
         arena_dims: arena dimensions, *in millimeters*.
         visualize: optional, indicates whether first few outputs should be plotted
         temperature: optional, adjusts entropy of probabilistic model outputs
+        mixed_precision: optional, run the model forward pass under bfloat16 autocast
     """
     outfile = Path(outfile)
 
@@ -124,117 +213,118 @@ def assess_model(
 
         scaled_locations_dataset = None
 
+        # raw outputs are only stored for reference, so keep them in half
+        # precision to halve the size of the file. quantities used to compute
+        # errors stay in single precision
         if isinstance(model, VocalocatorEnsemble):
             raw_output_dataset = []
             for i, constituent in enumerate(model.models):
                 raw_output_dataset.append(
-                    f.create_dataset(
-                        f"constituent_{i}_raw_output", shape=(N, constituent.n_outputs)
+                    BufferedDatasetWriter(
+                        f,
+                        f"constituent_{i}_raw_output",
+                        shape=(N, constituent.n_outputs),
+                        dtype=np.float16,
                     )
                 )
         else:
-            raw_output_dataset = f.create_dataset(
-                "raw_model_output", shape=(N, model.n_outputs)
+            raw_output_dataset = BufferedDatasetWriter(
+                f, "raw_model_output", shape=(N, model.n_outputs), dtype=np.float16
             )
 
-        point_predictions = f.create_dataset("point_predictions", shape=(N, 2))
+        point_predictions = BufferedDatasetWriter(f, "point_predictions", shape=(N, 2))
 
         ca = CalibrationAccumulator(arena_dims)
 
+        # the map from the [-1, 1] square to the arena is the affine transform
+        # x |--> 0.5 * arena_dims * (x + 1), whose scale and shift are equal
+        half_arena = 0.5 * np.asarray(arena_dims, dtype=np.float32)
+        n_arena_dims = len(half_arena)
+
         model.eval()
 
         should_compute_calibration = False
 
         with torch.no_grad():
             idx = 0
+            visualized = False
             for sounds, locations in tqdm(dataloader):
-                sounds = sounds.to(device)
-                # If inference, locations will be None
-
-                outputs: list[ModelOutput] = model(sounds, unbatched=True)
-                for output, location in zip(outputs, locations):
-                    # add batch dimension back
-                    if isinstance(model, VocalocatorEnsemble):
-                        for out_dataset, constituent_output in zip(
-                            raw_output_dataset, output.raw_output
-                        ):
-                            out_dataset[idx] = (
-                                constituent_output.raw_output.squeeze().cpu().numpy()
-                            )
-                    else:
-                        raw_output_dataset[idx] = (
-                            output.raw_output.squeeze().cpu().numpy()
+                # with a pinned-memory dataloader, the copy can proceed
+                # asynchronously with respect to the host
+                sounds = sounds.to(device, non_blocking=True)
+                batch_size = len(sounds)
+                # If inference, locations will be a list of None
+
+                with torch.autocast(
+                    device_type=torch.device(device).type,
+                    dtype=torch.bfloat16,
+                    enabled=mixed_precision,
+                ):
+                    output: ModelOutput = model(sounds)
+
+                if isinstance(model, VocalocatorEnsemble):
+                    for out_dataset, constituent_output in zip(
+                        raw_output_dataset, output.raw_output
+                    ):
+                        out_dataset.write(constituent_output.raw_output.cpu().numpy())
+                else:
+                    raw_output_dataset.write(output.raw_output.cpu().numpy())
+
+                point_predictions.write(
+                    output.point_estimate(units=Unit.MM).cpu().numpy()
+                )
+
+                # unscale locations from [-1, 1] square to units in arena (in mm)
+                if isinstance(locations, torch.Tensor):
+                    scaled_locations = locations.cpu().numpy()
+                    spatial_coords = scaled_locations[..., :n_arena_dims]
+                    spatial_coords *= half_arena
+                    spatial_coords += half_arena
+                    if scaled_locations_dataset is None:
+                        scaled_locations_dataset = BufferedDatasetWriter(
+                            f,
+                            "scaled_locations",
+                            shape=(N, *scaled_locations.shape[1:]),
+                        )
+                    scaled_locations_dataset.write(scaled_locations)
+
+                    # other useful info
+                    if isinstance(output, ProbabilisticOutput) and not inference:
+                        should_compute_calibration = True
+                        ca.calculate_step(
+                            output, scaled_locations, temperature=temperature
                         )
 
-                    point_predictions[idx] = (
-                        output.point_estimate(units=Unit.MM).cpu().numpy()
+                # update number of vocalizations seen
+                idx += batch_size
+
+                if (
+                    visualize
+                    and should_compute_calibration
+                    and not visualized
+                    and idx >= FIRST_N_VOX_TO_PLOT
+                ):
+                    point_predictions.flush()
+                    scaled_locations_dataset.flush()
+                    visualize_outfile = visualize_predictions(
+                        point_predictions.dataset[:FIRST_N_VOX_TO_PLOT],
+                        scaled_locations_dataset.dataset[:FIRST_N_VOX_TO_PLOT],
+                        ca.confidence_sets[:FIRST_N_VOX_TO_PLOT],
+                        (ca.xgrid, ca.ygrid),
+                        outfile,
                     )
+                    visualized = True
+                    print(f"Model output visualized at file {visualize_outfile}")
 
-                    # unscale location from [-1, 1] square to units in arena (in mm)
-                    if location is not None:
-                        scaled_location = (
-                            output._convert(location[None], Unit.ARBITRARY, Unit.MM)
-                            .cpu()
-                            .numpy()
-                        )
-                        if scaled_locations_dataset is None:
-                            scaled_locations_dataset = f.create_dataset(
-                                "scaled_locations",
-                                shape=(N, *scaled_location.shape[1:]),
-                            )
-                        scaled_locations_dataset[idx] = scaled_location
-
-                        # other useful info
-                        if isinstance(output, ProbabilisticOutput) and not inference:
-                            should_compute_calibration = True
-                            ca.calculate_step(
-                                output, scaled_location, temperature=temperature
-                            )
-
-                            if visualize and idx == FIRST_N_VOX_TO_PLOT:
-                                # plot the densities
-                                visualize_dir = outfile.parent / "pmfs_visualized"
-                                visualize_dir.mkdir(exist_ok=True, parents=True)
-                                visualize_outfile = (
-                                    visualize_dir / f"{outfile.stem}_visualized.png"
-                                )
-
-                                _, axs = subplots(FIRST_N_VOX_TO_PLOT)
-
-                                for i, ax in enumerate(axs):
-                                    ax.set_title(f"vocalization {i}")
-                                    ax.plot(
-                                        *point_predictions[i], "ro", label="predicted"
-                                    )
-                                    # add a green dot indicating the true location
-                                    ax.plot(
-                                        *scaled_locations_dataset[i], "go", label="true"
-                                    )
-                                    ax.set_aspect("equal", "box")
-
-                                    if should_compute_calibration:
-                                        set_to_plot = ca.confidence_sets[i]
-
-                                        xgrid, ygrid = make_xy_grids(
-                                            arena_dims,
-                                            shape=set_to_plot.shape,
-                                            return_center_pts=True,
-                                        )
-                                        ax.contourf(
-                                            xgrid,
-                                            ygrid,
-                                            set_to_plot,
-                                            label="95% confidence set",
-                                        )
-                                    ax.legend()
-
-                                plt.savefig(visualize_outfile)
-                                print(
-                                    f"Model output visualized at file {visualize_outfile}"
-                                )
-
-                    # update number of vocalizations seen
-                    idx += 1
+        # write out whatever is left in the buffers
+        writers = [point_predictions, scaled_locations_dataset]
+        if isinstance(raw_output_dataset, list):
+            writers.extend(raw_output_dataset)
+        else:
+            writers.append(raw_output_dataset)
+        for writer in writers:
+            if writer is not None:
+                writer.flush()
 
         # Cannot compute calibration curve on inference data
         if should_compute_calibration and not inference:
@@ -309,6 +399,40 @@ if __name__ == "__main__":
         help="Include flag to evaluate the model on datasets without ground truth.",
     )
 
+    parser.add_argument(
+        "--mixed-precision",
+        action="store_true",
+        help="Include flag to run the model in bfloat16 autocast during assessment.",
+    )
+
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help=(
+            "Include flag to compile the model with torch.compile and CUDA graphs "
+            "before assessment. Adds a one-time compilation cost."
+        ),
+    )
+
+    parser.add_argument(
+        "--export",
+        action="store_true",
+        help=(
+            "Include flag to run the model as a graph captured with torch.export. "
+            "Exported models are cached next to the output file and reused by "
+            "later runs with the same weights and input shape."
+        ),
+    )
+
+    parser.add_argument(
+        "--preload",
+        action="store_true",
+        help=(
+            "Include flag to load and preprocess the whole dataset onto the device "
+            "before assessment. Requires the dataset to fit in device memory."
+        ),
+    )
+
     parser.add_argument(
         "--index",
         type=Path,
@@ -331,12 +455,23 @@ if __name__ == "__main__":
     model.load_weights(
         best_weights_path=best_weights_path, use_final_weights=args.use_final
     )
+    # the model is only evaluated from here on, so the batch norm statistics
+    # can be baked into the neighboring weights
+    model = fold_batch_norm(model)
 
     device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    # every batch is cropped to the same length, so let cudnn autotune the
+    # convolution algorithms once and reuse them for the rest of the run
+    torch.backends.cudnn.benchmark = True
     if device == "cpu":
         config_data["GENERAL"]["DEVICE"] = "cpu"
     model = model.to(device)
 
+    if args.mixed_precision:
+        # let the float32 matmuls left outside of autocast use tensor cores too
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+
     arena_dims = np.array(config_data["DATA"]["ARENA_DIMS"])
     arena_dims_units = config_data["DATA"].get("ARENA_DIMS_UNITS")
     sample_rate = config_data["DATA"]["SAMPLE_RATE"]
@@ -374,12 +509,42 @@ if __name__ == "__main__":
         normalize_data=normalize_data,
         sample_rate=sample_rate,
         sample_vocalization_dir=vocalization_dir,
+        # draw each sample's crop from its own seed, so that the crops don't
+        # depend on how the samples are split across dataloader workers
+        crop_seed=0,
     )
 
     batch_size = config_data["DATA"]["BATCH_SIZE"]
-    dataloader = DataLoader(
-        dataset, batch_size=batch_size, shuffle=False, collate_fn=dataset.collate
-    )
+    if args.export:
+        # trace on a batch built by the dataset itself, so the input has the
+        # same shape and channels as the batches the model will actually see
+        example_batch, _ = dataset.collate(
+            [dataset[i] for i in range(min(batch_size, len(dataset)))]
+        )
+        model = export_model(
+            model,
+            example_batch.to(device),
+            cache_dir=Path(args.outfile).parent / "exported_models",
+        )
+
+    if args.compile:
+        # input shapes are fixed by the crop length and batch size, so the
+        # compiled graphs can be captured once and replayed for every batch
+        model = compile_model(model, mode="reduce-overhead", dynamic=False)
+
+    if args.preload:
+        dataloader = PreloadedBatches(dataset, batch_size, device)
+    else:
+        # load batches in background workers into page-locked memory so that
+        # host to device copies can run asynchronously
+        dataloader = DataLoader(
+            dataset,
+            batch_size=batch_size,
+            shuffle=False,
+            num_workers=available_cpus(),
+            pin_memory=device != "cpu",
+            collate_fn=dataset.collate,
+        )
 
     # make the parent directories for the desired outfile if they don't exist
     parent = Path(args.outfile).parent
@@ -394,4 +559,5 @@ if __name__ == "__main__":
         visualize=args.visualize,
         temperature=args.temperature,
         inference=args.inference,
+        mixed_precision=args.mixed_precision,
     )
@@ -3,7 +3,7 @@ Functions used in calculating the calibration of a model outputting mean + cov.
 """
 
 import logging
-from typing import Tuple, Union
+from typing import Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -94,15 +94,27 @@ def confidence_set_stats(
     threshhold: float,
     arena_dims: Union[Tuple[float, float], np.ndarray],
     true_location: np.ndarray,
+    center_grids: Optional[tuple[np.ndarray, np.ndarray]] = None,
+    edge_grids: Optional[tuple[np.ndarray, np.ndarray]] = None,
 ) -> tuple[np.ndarray, float, bool, float]:
     """
     Given a pmf, compute and return the `threshhold` confidence set, along with
     relevant info like its area, whether the true location is in the set, etc.
+
+    Optionally, `center_grids` and `edge_grids` may hold the x and y grids of
+    bin centers and bin edges matching the shape of `pmf`, to avoid
+    recomputing them for every pmf.
     """
+    if center_grids is None:
+        center_grids = make_xy_grids(
+            arena_dims, shape=pmf.shape, return_center_pts=True
+        )
+    if edge_grids is None:
+        edge_grids = make_xy_grids(arena_dims, shape=np.array(pmf.shape) + 1)
+    center_xgrid, center_ygrid = center_grids
+    edge_xgrid, edge_ygrid = edge_grids
+
     # find the mean of each pmf
-    center_xgrid, center_ygrid = make_xy_grids(
-        arena_dims, shape=pmf.shape, return_center_pts=True
-    )
 
     # pmf shape: (n_y_pts, n_x_pts)
     # marginal distributions over x: pmf.sum(axis=0)
@@ -117,7 +129,6 @@ def confidence_set_stats(
     confidence_set = calculate_confidence_set(pmf, threshhold)
 
     # was the true location in the confidence sets?
-    edge_xgrid, edge_ygrid = make_xy_grids(arena_dims, shape=np.array(pmf.shape) + 1)
     loc_bin = assign_to_bin_2d(true_location.reshape(1, 2), edge_xgrid, edge_ygrid)
     (y_idx, x_idx) = np.unravel_index(loc_bin, shape=pmf.shape)
     loc_in_confidence_set = bool(confidence_set[y_idx, x_idx])
@@ -171,6 +182,19 @@ class CalibrationAccumulator:
         self.location_in_confidence_set = []
         self.distances_to_furthest_point = []
 
+        # the pmfs are always evaluated on the same grid, so build it once
+        self.xgrid, self.ygrid = self._make_grids()
+        self.coords = torch.from_numpy(
+            np.dstack((self.xgrid, self.ygrid)).astype(np.float32)
+        )
+        # copies of `coords` on each device model outputs have been seen on
+        self._device_coords: dict[torch.device, torch.Tensor] = {}
+        # since the edge grids track the bin edges, they have one more
+        # point in each coordinate direction.
+        self.edge_xgrid, self.edge_ygrid = make_xy_grids(
+            self.arena_dims[:2], shape=np.array(self.xgrid.shape) + 1
+        )
+
     def calculate_step(
         self,
         model_output: ProbabilisticOutput,
@@ -178,7 +202,9 @@ class CalibrationAccumulator:
         temperature: float = 1.0,
     ):
         """
-        Perform one step of the calibration process on `model_output`.
+        Perform one step of the calibration process on `model_output`, which
+        may hold a batch of distributions. `true_location` is expected to hold
+        one location per batch element.
 
         Essentially, this function calculates the probability assigned to the
         smallest region in the xy plane containing the true location. These
@@ -194,19 +220,30 @@ class CalibrationAccumulator:
                 f"`ProbabilisticOutput`! Instead encountered object of type: {type(model_output)}."
             )
         # NOTE: true location expected in MM
-
-        # get the pmf
-        coords = self._make_coord_array()
-        # add a batch dimension to match expected shape from `ProbabilisticOutput.pmf`
-        coords = np.expand_dims(coords, -2)
-        pmf = (
-            model_output.pmf(torch.tensor(coords), Unit.MM, temperature=temperature)
-            .cpu()
-            .numpy()
-        )
-        # get rid of the extra batch dimension
-        pmf = pmf.squeeze()
-
+        batch_size = model_output.batch_size
+        true_locations = np.asarray(true_location).reshape(batch_size, -1)
+
+        # get the pmfs for the whole batch at once
+        # add a batch dimension to match expected shape from `ProbabilisticOutput.pmf`.
+        # the grid is expanded on the output's device, so this is a view of a
+        # single copy of the grid there rather than a new batch-sized tensor
+        device = torch.device(model_output.device)
+        if device not in self._device_coords:
+            self._device_coords[device] = self.coords.to(device)
+        coords = self._device_coords[device]
+        coords = coords[..., None, :].expand(*coords.shape[:-1], batch_size, 2)
+        pmfs = model_output.pmf(coords, Unit.MM, temperature=temperature)
+        # (n_y_bins, n_x_bins, batch_size) -> (batch_size, n_y_bins, n_x_bins)
+        pmfs = pmfs.permute(2, 0, 1).cpu().numpy()
+
+        for pmf, location in zip(pmfs, true_locations):
+            self._accumulate(pmf, location)
+
+    def _accumulate(self, pmf: np.ndarray, true_location: np.ndarray):
+        """
+        Update the tracked statistics with a single pmf and the corresponding
+        true location.
+        """
         # calculate the confidence set for this prediction
         # and store useful stats about it
         (
@@ -215,7 +252,12 @@ class CalibrationAccumulator:
             loc_in_confidence_set,
             dist_to_furthest_point,
         ) = confidence_set_stats(
-            pmf, self.confidence_set_threshold, self.arena_dims, true_location
+            pmf,
+            self.confidence_set_threshold,
+            self.arena_dims,
+            true_location,
+            center_grids=(self.xgrid, self.ygrid),
+            edge_grids=(self.edge_xgrid, self.edge_ygrid),
         )
 
         self.confidence_sets.append(confidence_set)
@@ -223,19 +265,15 @@ class CalibrationAccumulator:
         self.location_in_confidence_set.append(loc_in_confidence_set)
         self.distances_to_furthest_point.append(dist_to_furthest_point)
 
-        # get our x and ygrids to match the shape of the pmfs
-        # since the grids track the edge points, we should have
-        # one more point in each coordinate direction.
-        grid_shape = np.array(pmf.shape) + 1
-        xgrid, ygrid = make_xy_grids(self.arena_dims[:2], shape=grid_shape)
-
         # reshape location to (1, 2) if necessary
         # we do this so the repeat function works out correctly
         if true_location.shape != (1, 2):
             true_location = true_location.reshape((1, 2))
 
         # perform the calibration calculation step
-        mass = min_mass_containing_location(pmf, true_location, xgrid, ygrid)
+        mass = min_mass_containing_location(
+            pmf, true_location, self.edge_xgrid, self.edge_ygrid
+        )
 
         # transform to the bin in [0, 1] to which each value corresponds,
         # essentially iteratively building a histogram with each step
@@ -265,9 +303,10 @@ class CalibrationAccumulator:
 
         return results
 
-    def _make_coord_array(self):
+    def _make_grids(self) -> tuple[np.ndarray, np.ndarray]:
         """
-        Return a grid of evenly spaced points on the arena floor.
+        Return the x and y grids of evenly spaced points on the arena floor
+        at which the pmfs are evaluated.
         """
         xdim = self.arena_dims[0]
         ydim = self.arena_dims[1]
@@ -275,8 +314,4 @@ class CalibrationAccumulator:
         # change xgrid / ygrid size to preserve aspect ratio
         ratio = ydim / xdim
         desired_shape = (int(ratio * 100), 100)
-        xgrid, ygrid = make_xy_grids(
-            (xdim, ydim), shape=desired_shape, return_center_pts=True
-        )
-        coords = np.dstack((xgrid, ygrid)).astype(np.float32)
-        return coords
+        return make_xy_grids((xdim, ydim), shape=desired_shape, return_center_pts=True)
@@ -1,4 +1,5 @@
 import enum
+import math
 import sys
 from typing import List, Optional, Union
 
@@ -145,15 +146,18 @@ class ProbabilisticOutput(ModelOutput):
         """
         Calculate p(x) at each point on the coordinate grid for the
         distribution p parameterized by this model output instance, in a
-        vectorized and numerically stable way. Normalizes to sum to 1.
+        vectorized and numerically stable way. Expects the coordinate grid to
+        have shape (..., self.batch_size, 2), and normalizes the pmf of each
+        distribution in the batch to sum to 1.
 
         Optionally, provide a `temperature` parameter to adjust the entropy of
         the distribution. Higher temperatures shift the distribution towards uniform,
         lower temperatures towards a point mass at the mode.
         """
         probs = torch.exp(self.log_p(coordinate_grid, units=units) / temperature)
-        # normalize to 1
-        return probs / probs.sum()
+        # normalize to 1 over every dimension but the batch dimension
+        grid_dims = tuple(range(probs.ndim - 1))
+        return probs / probs.sum(dim=grid_dims, keepdim=True)
 
 
 class BaseDistributionOutput(ProbabilisticOutput):
@@ -212,7 +216,7 @@ class UniformOutput(BaseDistributionOutput):
                 f"found shape {x.shape}."
             )
         output_shape = x.shape[:-1]
-        return torch.log(torch.tensor(0.25)) * torch.ones(output_shape, device=x.device)
+        return torch.full(output_shape, math.log(0.25), device=x.device)
 
 
 class MDNOutput(ProbabilisticOutput):
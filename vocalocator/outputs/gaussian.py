@@ -1,3 +1,4 @@
+import math
 from typing import Union
 
 import torch
@@ -11,6 +12,9 @@ class GaussianOutput(BaseDistributionOutput):
     packages model output together with its units.
     """
 
+    # whether subclasses always produce diagonal Cholesky factors
+    diagonal_covs: bool = False
+
     def __init__(
         self,
         raw_output: torch.Tensor,
@@ -69,6 +73,18 @@ class GaussianOutput(BaseDistributionOutput):
                 f"expected second-to-last dim of input `x` to have the same shape. Instead "
                 f"found shape {x.shape}."
             )
+        if self.diagonal_covs:
+            # the density factorizes over the coordinates, so evaluate it
+            # directly rather than through the triangular solve and
+            # log-determinant of a general MultivariateNormal
+            stds = self.cholesky_covs.diagonal(dim1=-2, dim2=-1)  # (batch_size, 2)
+            z = (x - self.point_estimate()) / stds
+            return (
+                -0.5 * z.square().sum(dim=-1)
+                - stds.log().sum(dim=-1)
+                - 0.5 * self.n_dims * math.log(2 * math.pi)
+            )
+
         distr = torch.distributions.MultivariateNormal(
             loc=self.point_estimate(), scale_tril=self.cholesky_covs
         )
@@ -95,6 +111,7 @@ class GaussianOutput(BaseDistributionOutput):
 
 class GaussianOutputFixedVariance(GaussianOutput):
     N_OUTPUTS_EXPECTED = 2
+    diagonal_covs = True
     config_name = "GAUSSIAN_FIXED_VARIANCE"
 
     def __init__(
@@ -134,6 +151,7 @@ class GaussianOutputFixedVariance(GaussianOutput):
 
 class GaussianOutputSphericalCov(GaussianOutput):
     N_OUTPUTS_EXPECTED = 3
+    diagonal_covs = True
     config_name = "GAUSSIAN_SPHERICAL_COV"
 
     def __init__(
@@ -163,6 +181,7 @@ class GaussianOutputSphericalCov(GaussianOutput):
 
 class GaussianOutputDiagonalCov(GaussianOutput):
     N_OUTPUTS_EXPECTED = 4
+    diagonal_covs = True
     config_name = "GAUSSIAN_DIAGONAL_COV"
 
     def __init__(
@@ -0,0 +1,31 @@
+"""
+Helper script to write an uncompressed copy of the audio in HDF5 datasets,
+which is memory mapped in place of the HDF5 audio during training and
+assessment.
+"""
+
+import argparse
+from pathlib import Path
+
+from vocalocator.training.dataloaders import prepare_memmap
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(
+        description=(
+            "Write the audio of each HDF5 dataset to an uncompressed .npy file "
+            "next to it, to be memory mapped in place of the HDF5 audio."
+        )
+    )
+    p.add_argument("data", type=Path, nargs="+", help="Paths to HDF5 datasets")
+    p.add_argument(
+        "--chunk-size",
+        type=int,
+        default=2**20,
+        help="Number of audio samples converted at a time.",
+    )
+
+    args = p.parse_args()
+
+    for datapath in args.data:
+        out_path = prepare_memmap(datapath, chunk_size=args.chunk_size)
+        print(f"Wrote audio of {datapath} to {out_path}.")
@@ -27,7 +27,7 @@ class PolarityInversion(nn.Module):
 
 class TimeMask(nn.Module):
     """Time masking data augmentation. Masks a random part of the audio across all channels.
-    Mutates the input tensor in-place. A bit slow because it has to do a lot of indexing.
+    Mutates the input tensor in-place.
     """
 
     def __init__(
@@ -64,8 +64,13 @@ class TimeMask(nn.Module):
             self.min_mask_length, self.max_mask_length, (num_true,)
         )
         mask_end = mask_start + mask_lengths
-        for i, start, end in zip(prob_idx, mask_start, mask_end):
-            x[i, start:end, :] = 0
+        # build all of the masks at once as a (num_true, num_samples) boolean
+        # array rather than zeroing each sample's masked range separately
+        t = torch.arange(num_samples)
+        time_mask = (t >= mask_start[:, None]) & (t < mask_end[:, None])
+        mask = torch.zeros(bsz, num_samples, dtype=torch.bool)
+        mask[prob_idx] = time_mask
+        x.masked_fill_(mask.to(x.device)[..., None], 0)
         return x.reshape(*bshape, num_samples, num_channels)
 
 
@@ -31,6 +31,7 @@ DEFAULT_CONFIG = {
         "TORCH_SEED": 888,  # rng seeds for reproducibility
         "NUMPY_SEED": 777,
         "LOG_INTERVAL": 3,  # Amount of time between consecutive log messages
+        "COMPILE": False,  # compile the model with torch.compile before training
     },
     "DATA": {
         "NUM_MICROPHONES": 4,
@@ -42,6 +43,7 @@ DEFAULT_CONFIG = {
         "VOCALIZATION_DIR": None,
         "ARENA_DIMS": [572, 356],
         "ARENA_DIMS_UNITS": "MM",
+        "NUM_WORKERS": None,  # dataloader worker processes, None to use all available cpus
     },
     "AUGMENTATIONS": {
         # Data augmentations: involves performing augmentations to the audio to which the model should be invariant
@@ -14,6 +14,12 @@ from torch.nn import functional as F
 from torch.utils.data import DataLoader, Dataset
 from torchaudio import functional as AF
 
+# chunk cache used by the h5py file of each dataloader worker. the default of
+# 1MB is smaller than a single chunk of many of our datasets, in which case
+# every read decompresses its chunks again
+H5_CHUNK_CACHE_BYTES = 64 * 1024**2
+H5_CHUNK_CACHE_SLOTS = 100_003  # prime, as recommended by the HDF5 docs
+
 
 class VocalizationDataset(Dataset):
     def __init__(
@@ -27,6 +33,7 @@ class VocalizationDataset(Dataset):
         normalize_data: bool = True,
         sample_rate: int = 192000,
         sample_vocalization_dir: Optional[Path] = None,
+        crop_seed: Optional[int] = None,
     ):
         """
         Args:
@@ -35,6 +42,7 @@ class VocalizationDataset(Dataset):
             crop_length (int): Length of audio samples to return.
             arena_dims (Optional[Union[np.ndarray, Tuple[float, float]]], optional): Dimensions of the arena in mm. Used to scale labels.
             index (Optional[np.ndarray], optional): An array of indices to use for this dataset. Defaults to None, which will use the full dataset
+            crop_seed (Optional[int], optional): When provided, the random crop of each sample is drawn from a generator seeded by (crop_seed, index), so crops don't depend on the order samples are loaded in or on the number of dataloader workers. Defaults to None.
         """
         if isinstance(datapath, str):
             datapath = Path(datapath)
@@ -44,8 +52,9 @@ class VocalizationDataset(Dataset):
         # dataset cannot exist as a member of the object until after pytorch has cloned and
         # spread the dataset objects across multiple processes.
         # This is because h5py handles cannot be pickled and pytorch uses pickle under the hood
-        # I get around this by re-initializing the h5py.File lazily in __getitem__
-        self.dataset: Optional[h5py.File] = None
+        # I get around this by opening the h5py.File lazily in each process, see `dataset`
+        self._h5: Optional[h5py.File] = None
+        self._h5_pid: Optional[int] = None
 
         if not isinstance(arena_dims, np.ndarray):
             arena_dims = np.array(arena_dims).astype(np.float32)
@@ -55,12 +64,35 @@ class VocalizationDataset(Dataset):
 
         if "audio" in dataset:
             self.is_rir_dataset = False
-            self.length = len(dataset["length_idx"]) - 1
+            self.length_idx = dataset["length_idx"][:]
         elif "rir" in dataset:
             self.is_rir_dataset = True
-            self.length = len(dataset["rir_length_idx"]) - 1
+            self.length_idx = dataset["rir_length_idx"][:]
         else:
             raise ValueError("Improperly formatted dataset")
+        self.length = len(self.length_idx) - 1
+
+        # the offsets and labels are small, so keep them in memory rather than
+        # reading them from the file for every sample
+        self.locations = None
+        if "locations" in dataset:
+            self.locations = dataset["locations"][:]
+
+        # read audio from an uncompressed copy made by `prepare_memmap` when
+        # one is available and up to date. like the h5py file, it is opened
+        # lazily in __getitem__
+        self.memmap_path = None
+        self.audio: Optional[np.ndarray] = None
+        # buffer reused across reads of the h5py audio, allocated on first use
+        self.read_buffer: Optional[np.ndarray] = None
+        memmap_path = memmap_path_for(self.datapath)
+        if (
+            not self.is_rir_dataset
+            and memmap_path.exists()
+            and memmap_path.stat().st_mtime >= self.datapath.stat().st_mtime
+            and memmap_matches(memmap_path, dataset["audio"])
+        ):
+            self.memmap_path = memmap_path
 
         self.inference = inference
         self.arena_dims = arena_dims
@@ -69,6 +101,7 @@ class VocalizationDataset(Dataset):
         self.normalize_data = normalize_data
         self.sample_rate = sample_rate
         self.sample_vocalization_dir = sample_vocalization_dir
+        self.crop_seed = crop_seed
 
         if self.index is not None:
             self.length = len(self.index)
@@ -114,57 +147,121 @@ class VocalizationDataset(Dataset):
         imin, imax = iinfo.min, iinfo.max
         return (audio.astype(np.float64) / (imax - imin)).astype(np.float32)
 
+    @property
+    def dataset(self) -> h5py.File:
+        """
+        The h5py file backing this dataset. It is opened on first access in
+        each process, since handles inherited from a forked parent process
+        share its HDF5 library state.
+        """
+        if self._h5_pid != os.getpid():
+            self.__open()
+        return self._h5
+
+    def __open(self):
+        """Open the files backing this dataset in the current process."""
+        self._h5 = h5py.File(
+            self.datapath,
+            "r",
+            rdcc_nbytes=H5_CHUNK_CACHE_BYTES,
+            rdcc_nslots=H5_CHUNK_CACHE_SLOTS,
+        )
+        self._h5_pid = os.getpid()
+        self.audio, self.read_buffer = None, None
+        if self.memmap_path is not None:
+            self.audio = np.load(self.memmap_path, mmap_mode="r")
+        elif not self.is_rir_dataset:
+            audio = self._h5["audio"]
+            # only the crop of each sample is read
+            max_length = min(np.diff(self.length_idx).max(), self.crop_length)
+            self.read_buffer = np.empty(
+                (max_length, *audio.shape[1:]), dtype=audio.dtype
+            )
+
+    def __getstate__(self):
+        # open files can't be pickled (and a pickled memmap would be copied
+        # in full), so they are reopened on first use after unpickling
+        state = self.__dict__.copy()
+        state.update(_h5=None, _h5_pid=None, audio=None, read_buffer=None)
+        return state
+
     def __len__(self):
         return self.length
 
     def __getitem__(self, idx):
-        if self.dataset is None:
-            self.dataset = h5py.File(self.datapath, "r")
+        if self._h5_pid != os.getpid():
+            self.__open()
         true_idx = idx
         if self.index is not None:
             true_idx = self.index[idx]
+        if self.crop_seed is not None:
+            self.rng = np.random.default_rng((self.crop_seed, true_idx))
         return self.__processed_data_for_index__(true_idx)
 
-    def __make_crop(self, audio: torch.Tensor, crop_length: int):
-        """Given an audio sample of shape (n_samples, n_channels), return a random crop
-        of shape (crop_length, n_channels)
+    def __crop_range(self, audio_len: int, crop_length: int) -> Tuple[int, int]:
+        """Given the length of an audio sample, return the start and end of a random
+        crop of length crop_length, or of the whole sample if it is shorter.
         """
-        audio_len, _ = audio.shape
         valid_range = audio_len - crop_length
-        if valid_range <= 0:  # Audio is shorter than desired crop length, pad right
-            pad_size = crop_length - audio_len
-            # will fail if input is numpy array
-            return F.pad(audio, (0, 0, 0, pad_size))
+        if valid_range <= 0:  # Audio is shorter than desired crop length
+            return 0, audio_len
         if self.inference:
             range_start = 0
         else:
             range_start = self.rng.integers(0, valid_range)
-        range_end = range_start + crop_length
-        return audio[range_start:range_end, :]
+        return range_start, range_start + crop_length
+
+    def __make_crop(self, audio: torch.Tensor, crop_length: int):
+        """Given an audio sample of shape (n_samples, n_channels), return a random crop
+        of shape (crop_length, n_channels)
+        """
+        range_start, range_end = self.__crop_range(len(audio), crop_length)
+        return self.__pad_crop(audio[range_start:range_end, :], crop_length)
+
+    @staticmethod
+    def __pad_crop(audio: torch.Tensor, crop_length: int):
+        """Right-pads a crop shorter than crop_length with zeros."""
+        pad_size = crop_length - len(audio)
+        if pad_size <= 0:
+            return audio
+        # will fail if input is numpy array
+        return F.pad(audio, (0, 0, 0, pad_size))
 
     def __rir_for_index(self, idx: int):
         if self.is_rir_dataset:
-            start, end = self.dataset["rir_length_idx"][idx : idx + 2]
+            start, end = self.length_idx[idx : idx + 2]
             return torch.from_numpy(self.dataset["rir"][start:end, ...]).float()
         raise ValueError("Dataset does not contain RIRs")
 
     def __audio_for_index(self, idx: int):
-        """Gets an audio sample from the dataset. Will determine the format
-        of the dataset and handle it appropriately.
+        """Gets a random crop of an audio sample from the dataset. Will determine
+        the format of the dataset and handle it appropriately. Only the samples
+        within the crop are read and converted.
         """
-        start, end = self.dataset["length_idx"][idx : idx + 2]
-        audio = self.dataset["audio"][start:end, ...]
-        return torch.from_numpy(audio.astype(np.float32))
+        start, end = self.length_idx[idx : idx + 2]
+        range_start, range_end = self.__crop_range(end - start, self.crop_length)
+        start, end = start + range_start, start + range_end
+        if self.audio is not None:
+            audio = self.audio[start:end, ...]
+        else:
+            # read into the reusable buffer rather than a new array, the
+            # conversion below copies it out before it is overwritten
+            audio = self.read_buffer[: end - start]
+            self.dataset["audio"].read_direct(
+                audio, source_sel=np.s_[start:end], dest_sel=np.s_[: end - start]
+            )
+        audio = torch.from_numpy(audio.astype(np.float32))
+        return self.__pad_crop(audio, self.crop_length)
 
     def __label_for_index(self, idx: int):
-        if "locations" not in self.dataset:
+        if self.locations is None:
             return None
-        return torch.from_numpy(self.dataset["locations"][idx].astype(np.float32))
+        return torch.from_numpy(self.locations[idx].astype(np.float32))
 
     def scale_features(
         self,
-        audio: np.ndarray,
-        labels: np.ndarray,
+        audio: torch.Tensor,
+        labels: Optional[torch.Tensor],
     ):
         """Scales the inputs to have zero mean and unit variance. Labels are scaled
         from millimeter units to an arbitrary unit with range [-1, 1].
@@ -178,8 +275,12 @@ class VocalizationDataset(Dataset):
                 torch.from_numpy(self.arena_dims).float() / 2
             )
 
+        scaled_audio = audio
         if self.normalize_data:
-            scaled_audio = (audio - audio.mean()) / audio.std()
+            # each sample's audio is a fresh tensor, so normalize it in place,
+            # computing both moments in one call
+            std, mean = torch.std_mean(audio)
+            scaled_audio = audio.sub_(mean).div_(std)
 
         return scaled_audio, scaled_labels
 
@@ -193,10 +294,10 @@ class VocalizationDataset(Dataset):
             ]
 
             sound = AF.convolve(rir.T, sample_vocalization[None, :], mode="full").T
+            sound = self.__make_crop(sound, self.crop_length)
         else:
             sound = self.__audio_for_index(idx)
 
-        sound = self.__make_crop(sound, self.crop_length)
         location = self.__label_for_index(idx)
 
         sound, location = self.scale_features(sound, location)
@@ -208,7 +309,11 @@ class VocalizationDataset(Dataset):
         a batch of audio and labels.
         """
         audio, labels = [x[0] for x in batch], [x[1] for x in batch]
-        audio = torch.stack(audio)
+        # lay the batch out in memory as (batch, channels, time) while keeping
+        # its shape as (batch, time, channels). the transpose to channels-first
+        # at the start of the models' forward pass is then a free view rather
+        # than a copy, and the copy happens here in the dataloader workers
+        audio = torch.stack([a.T for a in audio]).transpose(-1, -2)
         if labels[0] is not None:
             labels = torch.stack(labels)
         else:
@@ -216,6 +321,130 @@ class VocalizationDataset(Dataset):
         return audio, labels
 
 
+def memmap_path_for(datapath: Union[Path, str]) -> Path:
+    """
+    Path of the uncompressed audio written by `prepare_memmap` for the HDF5
+    dataset at `datapath`.
+    """
+    datapath = Path(datapath)
+    return datapath.with_name(f"{datapath.stem}_audio.npy")
+
+
+def memmap_matches(memmap_path: Union[Path, str], audio: h5py.Dataset) -> bool:
+    """
+    Whether the .npy file at `memmap_path` holds a copy of the HDF5 `audio`
+    dataset as written by `prepare_memmap`, judging by the shape and dtype in
+    its header.
+    """
+    try:
+        memmap = np.load(memmap_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return False
+    return memmap.shape == audio.shape and memmap.dtype == np.float32
+
+
+def prepare_memmap(datapath: Union[Path, str], chunk_size: int = 2**20) -> Path:
+    """
+    Write the audio of the HDF5 dataset at `datapath` to an uncompressed float32
+    .npy file next to it, which VocalizationDataset memory maps in place of the
+    HDF5 audio whenever it is newer than the dataset and matches its shape. This
+    trades disk space for reads that need no HDF5 chunk lookups or decompression.
+    Run `python -m vocalocator.prepare_memmap` to do this from the command line.
+
+    Returns the path of the written file.
+    """
+    out_path = memmap_path_for(datapath)
+    # write to a temporary file first so that an interrupted conversion is
+    # never mistaken for a complete one
+    tmp_path = out_path.with_name(f"{out_path.stem}.tmp.npy")
+    with h5py.File(datapath, "r") as f:
+        if "audio" not in f:
+            raise ValueError("Only datasets containing audio can be memory mapped")
+        audio = f["audio"]
+        out = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=audio.shape
+        )
+        for start in range(0, len(audio), chunk_size):
+            out[start : start + chunk_size] = audio[start : start + chunk_size]
+        out.flush()
+        del out
+    tmp_path.replace(out_path)
+    return out_path
+
+
+def seed_worker(worker_id: int):
+    """
+    DataLoader `worker_init_fn` giving each worker's copy of the dataset its own
+    random generator. Otherwise every worker inherits the generator of the
+    dataset as it was created in the main process, and draws the same crops.
+    """
+    worker_info = torch.utils.data.get_worker_info()
+    worker_info.dataset.rng = np.random.default_rng(worker_info.seed)
+
+
+def available_cpus() -> int:
+    """
+    Number of CPUs available to DataLoader workers, leaving one for the main process.
+    """
+    try:
+        return max(1, len(os.sched_getaffinity(0)) - 1)
+    except:
+        return max(1, os.cpu_count() - 1)
+
+
+class PreloadedBatches:
+    """
+    Iterable over the batches of a dataset which has been processed once up
+    front and stored on `device`, for use in place of a DataLoader when the
+    whole dataset fits in device memory. Batches are then slices of the stored
+    audio, with no per batch loading, collation, or host to device copies.
+
+    Since each sample is only processed once, this is only meant for
+    iterating over a dataset a single time, or for datasets with
+    deterministic crops (`inference=True` or `crop_seed` set).
+    """
+
+    def __init__(
+        self,
+        dataset: VocalizationDataset,
+        batch_size: int,
+        device: Union[str, torch.device],
+    ):
+        self.dataset = dataset
+        self.batch_size = batch_size
+
+        loader = DataLoader(
+            dataset,
+            batch_size=batch_size,
+            shuffle=False,
+            num_workers=available_cpus(),
+            collate_fn=dataset.collate,
+        )
+        audio, labels = [], []
+        for batch_audio, batch_labels in loader:
+            # keep the (batch, channels, time) memory layout from `collate`
+            audio.append(batch_audio.transpose(-1, -2).to(device))
+            labels.append(batch_labels)
+        self.audio = torch.cat(audio).transpose(-1, -2)
+        self.labels = None
+        if labels and isinstance(labels[0], torch.Tensor):
+            self.labels = torch.cat(labels).to(device)
+
+    def __len__(self):
+        return -(-len(self.dataset) // self.batch_size)
+
+    def __iter__(self):
+        for start in range(0, len(self.dataset), self.batch_size):
+            end = start + self.batch_size
+            audio = self.audio[start:end]
+            if self.labels is None:
+                labels = [None] * len(audio)
+            else:
+                # consumers may modify the labels in place
+                labels = self.labels[start:end].clone()
+            yield audio, labels
+
+
 def build_dataloaders(
     path_to_data: Union[Path, str], config: dict, index_dir: Optional[Path]
 ) -> tuple[DataLoader, DataLoader, Optional[DataLoader]]:
@@ -241,10 +470,17 @@ def build_dataloaders(
         if (index_dir / "test_set.npy").exists():
             index_arrays["test"] = np.load(index_dir / "test_set.npy")
 
-    try:
-        avail_cpus = max(1, len(os.sched_getaffinity(0)) - 1)
-    except:
-        avail_cpus = max(1, os.cpu_count() - 1)
+    num_workers = config["DATA"].get("NUM_WORKERS")
+    if num_workers is None:
+        num_workers = available_cpus()
+    # load batches in background workers into page-locked memory so that
+    # copies to the gpu can run asynchronously
+    worker_kwargs = {
+        "num_workers": num_workers,
+        "pin_memory": torch.cuda.is_available()
+        and config["GENERAL"].get("DEVICE") != "CPU",
+        "worker_init_fn": seed_worker,
+    }
 
     if path_to_data.is_dir():
         train_path = path_to_data / "train_set.h5"
@@ -297,16 +533,24 @@ def build_dataloaders(
         traindata,
         batch_size=batch_size,
         shuffle=True,
-        num_workers=avail_cpus,
+        # every training batch has the same shape, unless there is only one
+        drop_last=len(traindata) > batch_size,
         collate_fn=traindata.collate,
+        # keep the training workers (and their open h5py files) alive between
+        # epochs, and have them load batches further ahead of time. the
+        # validation workers are only needed briefly, so they are torn down
+        # after each pass rather than holding their memory for the whole run
+        persistent_workers=num_workers > 0,
+        prefetch_factor=4 if num_workers > 0 else None,
+        **worker_kwargs,
     )
 
     val_dataloader = DataLoader(
         valdata,
         batch_size=batch_size,
-        num_workers=avail_cpus,
         shuffle=False,
         collate_fn=valdata.collate,
+        **worker_kwargs,
     )
 
     test_dataloader = None
@@ -327,6 +571,7 @@ def build_dataloaders(
             num_workers=1,
             shuffle=False,
             collate_fn=testdata.collate,
+            worker_init_fn=seed_worker,
         )
 
     return train_dataloader, val_dataloader, test_dataloader
@@ -51,7 +51,7 @@ def wass_loss_fn(pred: torch.Tensor, target: torch.Tensor):
     flat_pred = torch.flatten(pred, start_dim=1)
     flat_target = torch.flatten(target, start_dim=1)
     # Add 1 to target to make the smallest value 0
-    error_map = F.log_softmax(flat_pred, dim=1) + torch.log(flat_target + 1)
+    error_map = F.log_softmax(flat_pred, dim=1) + torch.log1p(flat_target)
     return torch.logsumexp(error_map, dim=1)
 
 
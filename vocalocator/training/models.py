@@ -1,8 +1,11 @@
 """Initialize model and loss function from configuration."""
 
+import hashlib
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Callable, Union
+from typing import Any, Callable, Optional, Union
 
 import numpy as np
 import torch
@@ -151,18 +154,25 @@ def build_model(config: dict[str, Any]) -> tuple[VocalocatorArchitecture, LossFu
 
     if arch == "vocalocatorensemble":
         # None out the other parameters
-        built_submodels = []
+        sub_model_configs = []
         for sub_model_config in config["MODEL_PARAMS"]["CONSTITUENT_MODELS"]:
             if not isinstance(sub_model_config, dict):
                 # A path to a config was passed instead of the config contents
+                if not Path(sub_model_config).exists():
+                    raise ValueError(
+                        f"Path to submodel config {sub_model_config} does not exist!"
+                    )
                 with open(sub_model_config, "r") as f:
-                    if not Path(sub_model_config).exists():
-                        raise ValueError(
-                            f"Path to submodel config {sub_model_config} does not exist!"
-                        )
                     sub_model_config = json.load(f)
-            submodel, _ = build_model(sub_model_config)
-            built_submodels.append(submodel)
+            sub_model_configs.append(sub_model_config)
+
+        # the constituent models are independent, so build them concurrently.
+        # each one only writes to its own config dict
+        n_workers = min(len(sub_model_configs), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+            built_submodels = [
+                submodel for submodel, _ in executor.map(build_model, sub_model_configs)
+            ]
         model = VocalocatorEnsemble(config, built_submodels, output_factory)
     elif arch.lower() in ARCHITECTURES:
         model = ARCHITECTURES[arch]
@@ -173,17 +183,126 @@ def build_model(config: dict[str, Any]) -> tuple[VocalocatorArchitecture, LossFu
     return model, loss
 
 
-def __apply_affine(locations: np.ndarray, A: np.ndarray, b: np.ndarray):
+def compile_model(
+    model: VocalocatorArchitecture, **compile_kwargs
+) -> VocalocatorArchitecture:
     """
-    Helper function to apply an affine transformation Ax + b
-    to a list of vectors.
+    Compile the network of `model` in place with `torch.compile`, forwarding
+    `compile_kwargs` to it. For ensembles, each constituent model is compiled.
 
-    Args:
-        locations: Array of shape (n_samples, k)
-        A: Array of shape (k, k)
-        b: Array of shape (k,)
+    Only the `_forward` method mapping audio to raw output is compiled, so the
+    model keeps its class, attributes, and state dict keys, and existing
+    weights can be loaded into or saved from it as usual.
     """
-    return (A @ locations[..., None]).squeeze() + b
+    if isinstance(model, VocalocatorEnsemble):
+        for submodel in model.models:
+            compile_model(submodel, **compile_kwargs)
+    else:
+        model._forward = torch.compile(model._forward, **compile_kwargs)
+    return model
+
+
+class _RawForward(torch.nn.Module):
+    """Expose the `_forward` method of a model as a module for `torch.export`."""
+
+    def __init__(self, model: VocalocatorArchitecture):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.model._forward(x)
+
+
+def _export_key(model: VocalocatorArchitecture, example_input: torch.Tensor) -> str:
+    """
+    Hash everything an exported program depends on: the model config and
+    weights, the shape, dtype and device of its input, and the torch version.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps(model.config, sort_keys=True, default=str).encode())
+    hasher.update(
+        f"{tuple(example_input.shape)}{example_input.dtype}{example_input.device}".encode()
+    )
+    hasher.update(torch.__version__.encode())
+    for name, tensor in model.state_dict().items():
+        hasher.update(name.encode())
+        hasher.update(tensor.detach().cpu().reshape(-1).view(torch.uint8).numpy())
+    return hasher.hexdigest()[:16]
+
+
+def export_model(
+    model: VocalocatorArchitecture,
+    example_input: torch.Tensor,
+    cache_dir: Optional[Union[Path, str]] = None,
+) -> VocalocatorArchitecture:
+    """
+    Replace the network of `model` in place with the graph captured by
+    `torch.export` from the eval mode model on inputs shaped like
+    `example_input`, so calls no longer run through the python module
+    hierarchy. The batch dimension is left dynamic. For ensembles, each
+    constituent model is exported.
+
+    If `cache_dir` is provided, the exported programs are saved there keyed
+    on the config, weights, and input shape of each model, and reloaded by
+    later runs instead of being exported again.
+
+    As with `compile_model`, only `_forward` is replaced, but the exported
+    graph holds its own copy of the weights, so the model should be on its
+    final device and finished loading weights before being exported.
+
+    Requires a version of torch providing `torch.export.Dim.AUTO` (2.6+).
+    """
+    export = getattr(torch, "export", None)
+    if export is None or not hasattr(getattr(export, "Dim", None), "AUTO"):
+        raise ValueError(
+            f"Exporting models requires torch>=2.6, but torch {torch.__version__} "
+            "is installed. Upgrade torch or run without exporting the model."
+        )
+
+    if isinstance(model, VocalocatorEnsemble):
+        for submodel in model.models:
+            export_model(submodel, example_input, cache_dir=cache_dir)
+        return model
+
+    model.eval()
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"{_export_key(model, example_input)}.pt2"
+
+    if cache_path is not None and cache_path.exists():
+        print(f"Loading exported model from path {cache_path}.")
+        exported = torch.export.load(cache_path)
+    else:
+        exported = torch.export.export(
+            _RawForward(model),
+            (example_input,),
+            dynamic_shapes=({0: torch.export.Dim.AUTO},),
+        )
+        if cache_path is not None:
+            cache_path.parent.mkdir(exist_ok=True, parents=True)
+            torch.export.save(exported, cache_path)
+
+    # bind the method rather than the module, which would otherwise be
+    # registered as a submodule and end up in the state dict
+    model._forward = exported.module().forward
+    return model
+
+
+def fold_batch_norm(model: VocalocatorArchitecture) -> VocalocatorArchitecture:
+    """
+    Fold the batch norm layers of `model` into the weights of the layers
+    reading their output, in place, for architectures which support it. For
+    ensembles, each constituent model is folded.
+
+    The folded model only matches the original in eval mode, so this is meant
+    for inference after the weights have been loaded.
+    """
+    if isinstance(model, VocalocatorEnsemble):
+        for submodel in model.models:
+            fold_batch_norm(submodel)
+    elif hasattr(model, "fold_batch_norm"):
+        model.fold_batch_norm()
+    return model
 
 
 def unscale_output(
@@ -206,11 +325,17 @@ def unscale_output(
 
         A = 1/2 * [[a_1 ,  0  ],
                    [0   ,  a_2]].
+
+    Since A is diagonal and its diagonal is equal to b, this is computed
+    elementwise as z_i = b * y_i + b.
     """
-    A = 0.5 * np.diag(arena_dims)  # rescaling matrix
-    b = 0.5 * np.array(arena_dims)  # recentering vector
+    # keep single precision output in single precision, but promote anything
+    # else (e.g. integer input) to at least float32
+    dtype = np.result_type(model_output.dtype, np.float32)
+    b = 0.5 * np.asarray(arena_dims, dtype=dtype)  # rescaling and recentering
+    cov_scale = np.outer(b, b)  # A @ S @ A.T == S * outer(b, b) for diagonal A
 
-    unscaled = np.zeros(model_output.shape)
+    unscaled = np.empty(model_output.shape, dtype=dtype)
 
     # if the model outputs a mean y and a covariance matrix S, the transformed
     # mean is given by Ay + b, and the cov matrix is given by A @ S @ A.T
@@ -220,8 +345,8 @@ def unscale_output(
         cholesky = model_output[:, 1:]  # shape: (len(model_output), 2, 2)
         covs = cholesky @ cholesky.swapaxes(-1, -2)
 
-        unscaled[:, 0] = __apply_affine(means, A, b)
-        unscaled[:, 1:] = A @ covs @ A.T
+        unscaled[:, 0] = means * b + b
+        unscaled[:, 1:] = covs * cov_scale
 
     # similar if model outputs a batch of means + cholesky covariances
     # this is the case for ensemble models
@@ -230,12 +355,12 @@ def unscale_output(
         cholesky = model_output[:, :, 1:]  # shape: (batch_size, n_models, 2, 2)
         covs = cholesky @ cholesky.swapaxes(-1, -2)
 
-        unscaled[:, :, 0] = __apply_affine(means, A, b)
-        unscaled[:, :, 1:] = A @ covs @ A.T
+        unscaled[:, :, 0] = means * b + b
+        unscaled[:, :, 1:] = covs * cov_scale
 
     # otherwise, just apply the affine transformation
     elif model_output.ndim == 2 and model_output.shape[1] == 2:
-        unscaled = __apply_affine(model_output, A, b)
+        unscaled = model_output * b + b
     else:
         raise ValueError(
             f"Unscaling not currently supported for output of shape {model_output.shape}!"
@@ -18,7 +18,7 @@ from ..outputs.base import ModelOutput, ProbabilisticOutput, Unit
 from ..training.augmentations import build_augmentations
 from ..training.dataloaders import build_dataloaders
 from ..training.logger import ProgressLogger
-from ..training.models import build_model
+from ..training.models import build_model, compile_model
 
 JSON = NewType("JSON", dict)
 
@@ -168,6 +168,13 @@ class Trainer:
         if not self.__eval:
             self.__config["WEIGHTS_PATH"] = self.__best_weights_file
         self.model.to(self.device)
+        if self.__config["GENERAL"].get("COMPILE", False):
+            # crop length and batch size are fixed by the config, so the
+            # graphs can be compiled for static shapes and replayed as CUDA
+            # graphs. the first few batches pay the compilation cost
+            self.model = compile_model(
+                self.model, mode="reduce-overhead", dynamic=False
+            )
 
         # In inference mode, there is no logger
         if not self.__eval:
@@ -270,8 +277,8 @@ class Trainer:
         iter = 0
         for sounds, locations in self.__traindata:
             # Move data to device
-            sounds = sounds.to(self.device)
-            locations = locations.to(self.device)
+            sounds = sounds.to(self.device, non_blocking=True)
+            locations = locations.to(self.device, non_blocking=True)
 
             # This should always exist, but might be the identity function
             sounds = self.augment(sounds)
@@ -307,7 +314,7 @@ class Trainer:
                 idx = 0
                 compute_calibration = False
                 for sounds, locations in self.__valdata:
-                    sounds = sounds.to(self.device)
+                    sounds = sounds.to(self.device, non_blocking=True)
 
                     batch_err = 0
 